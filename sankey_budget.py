@@ -1,115 +1,112 @@
+"""Streamlit app for visualizing a budget as an Income -> Budget -> Expenses Sankey diagram.
+
+Figures are serialized for the browser by plotly.io, which uses orjson automatically
+when it is installed (it is listed in requirements.txt) and falls back to the standard
+json module otherwise.
+"""
+
+from itertools import cycle, islice
+from math import fsum
+
 import plotly.graph_objects as go
 import plotly.colors as pc
 import streamlit as st
 
-def create_budget_sankey(
-    income_sources,
-    expenses,
-    title="Budget Sankey Diagram",
-    title_color="black",
-    layout=None
-):
-    """Creates a dynamic Sankey diagram to visualize a budget with three verticals:
-    Income -> Budget -> Expenses. Each node displays its amount next to its label.
+# Layout shared by every diagram; the title text and color are filled in per figure
+_DEFAULT_LAYOUT = {
+    "title_font": {"size": 24},
+    "font_size": 12,
+    "height": 700,
+    "width": 1000
+}
+
+def _evenly_spaced(n):
+    """Returns n positions evenly spaced strictly between 0 and 1.
 
     Parameters:
-    - income_sources (dict): Dictionary of income sources and their amounts.
-    - expenses (dict): Dictionary of expense categories and their amounts.
-    - title (str): Title of the Sankey diagram.
-    - title_color (str): Color of the title text.
-    - layout (dict): Layout configuration for the Plotly figure.
+    - n (int): Number of positions.
 
     Returns:
-    - fig (go.Figure): Plotly Figure object representing the Sankey diagram.
+    - positions (list): List of n floats.
     """
-    
-    # Calculate total income and expenses
-    total_income = sum(income_sources.values())
-    total_expenses = sum(expenses.values())
+    spacing = 1.0 / (n + 1)
+    return [(i + 1) * spacing for i in range(n)]
 
-    # Validate total income vs expenses
-    if total_income < total_expenses:
-        discrepancy = total_expenses - total_income
-        st.warning(f"Total expenses (${total_expenses:,.2f}) exceed total income (${total_income:,.2f}).")
-        st.warning(f"Discrepancy: ${discrepancy:,.2f}")
-    else:
-        st.success(f"Total Income: ${total_income:,.2f}")
-        st.success(f"Total Expenses: ${total_expenses:,.2f}")
+def _expanded_palette(name, n):
+    """Returns the first n colors of a Plotly qualitative palette, repeating it as needed.
 
-    # Define nodes: incomes, budget, and expenses
-    income_labels = list(income_sources.keys())
-    expense_labels = list(expenses.keys())
+    Parameters:
+    - name (str): Name of the palette in plotly.colors.qualitative (e.g. "Pastel1").
+    - n (int): Number of colors required.
+
+    Returns:
+    - colors (tuple): Tuple of n color strings.
+    """
+    return tuple(islice(cycle(getattr(pc.qualitative, name)), n))
+
+def _node_labels(income_sources, expenses, total_income):
+    """Returns the node labels in diagram order (incomes, budget, expenses), each with its amount appended.
+
+    Parameters:
+    - income_sources (dict): Dictionary of income sources and their amounts.
+    - expenses (dict): Dictionary of expense categories and their amounts.
+    - total_income (float): Amount shown on the Budget node.
+
+    Returns:
+    - labels (list): List of label strings.
+    """
     budget_label = "Budget"
 
-    # Append amounts to labels
+    # Append amounts to labels, formatting each amount exactly once
     income_labels_with_amount = [f"{label}\n${amount:,.2f}" for label, amount in income_sources.items()]
     budget_label_with_amount = f"{budget_label}\n${total_income:,.2f}"  # Assuming Budget receives all income
     expense_labels_with_amount = [f"{label}\n${amount:,.2f}" for label, amount in expenses.items()]
 
-    all_labels = income_labels_with_amount + [budget_label_with_amount] + expense_labels_with_amount
-
-    num_income = len(income_labels)
-    num_expense = len(expense_labels)
-
-    # Assign unique indices to each node
-    label_indices = {label: idx for idx, label in enumerate(all_labels)}
-
-    # Assign colors to income sources
-    income_colors_palette = pc.qualitative.Pastel1  # Using Plotly's qualitative color palette for income
-    if len(income_labels) > len(income_colors_palette):
-        income_colors_palette = income_colors_palette * (len(income_labels) // len(income_colors_palette) + 1)
-    income_color_map = {income: income_colors_palette[i] for i, income in enumerate(income_labels)}
-
-    # Assign colors to expenses
-    expense_colors_palette = pc.qualitative.Pastel2  # Using Plotly's qualitative color palette for expenses
-    if len(expense_labels) > len(expense_colors_palette):
-        expense_colors_palette = expense_colors_palette * (len(expense_labels) // len(expense_colors_palette) + 1)
-    expense_color_map = {expense: expense_colors_palette[i] for i, expense in enumerate(expense_labels)}
-
-    # Define sources, targets, and values for the Sankey diagram
-    sources = []
-    targets = []
-    values = []
-    colors = []
-
-    # Flows from Income Sources to Budget
-    for income, amount in income_sources.items():
-        sources.append(label_indices[f"{income}\n${amount:,.2f}"])
-        targets.append(label_indices[budget_label_with_amount])
-        values.append(amount)
-        colors.append(income_color_map[income])
-
-    # Flows from Budget to Expenses
-    for expense, amount in expenses.items():
-        sources.append(label_indices[budget_label_with_amount])
-        targets.append(label_indices[f"{expense}\n${amount:,.2f}"])
-        values.append(amount)
-        colors.append(expense_color_map[expense])
+    return income_labels_with_amount + [budget_label_with_amount] + expense_labels_with_amount
+
+def _build_sankey(income_sources, expenses, total_income, title, title_color, layout):
+    """Builds the Sankey figure once the totals are known.
+
+    Parameters:
+    - income_sources (dict): Dictionary of income sources and their amounts.
+    - expenses (dict): Dictionary of expense categories and their amounts.
+    - total_income (float): Sum of the income amounts, shown on the Budget node.
+    - title (str): Title of the Sankey diagram.
+    - title_color (str): Color of the title text.
+    - layout (dict): Layout configuration merged into the figure layout.
+
+    Returns:
+    - fig (go.Figure): Plotly Figure object representing the Sankey diagram.
+    """
+    # Define nodes: incomes, budget, and expenses
+    all_labels = _node_labels(income_sources, expenses, total_income)
+
+    num_income = len(income_sources)
+    num_expense = len(expenses)
+
+    # Flows run Income -> Budget -> Expenses; node indices follow the label order:
+    # incomes are 0..num_income-1, the budget is num_income, expenses come after it
+    budget_index = num_income
+    sources = list(range(num_income)) + [budget_index] * num_expense
+    targets = [budget_index] * num_income + list(range(budget_index + 1, budget_index + 1 + num_expense))
+    values = list(income_sources.values()) + list(expenses.values())
+
+    # Color each flow from Plotly's qualitative palettes
+    colors = list(_expanded_palette("Pastel1", num_income)) + list(_expanded_palette("Pastel2", num_expense))
 
     # Define node positions for fixed arrangement
-    node_x = []
-    node_y = []
-
-    # Income nodes: x=0
-    for _ in income_labels:
-        node_x.append(0)
-    # Budget node: x=0.5
-    node_x.append(0.5)
-    # Expense nodes: x=1
-    for _ in expense_labels:
-        node_x.append(1)
-
-    # Calculate y positions
-    # Income nodes: evenly spaced
-    income_y_spacing = 1 / (num_income + 1)
-    for i in range(num_income):
-        node_y.append((i + 1) * income_y_spacing)
-    # Budget node: centered
-    node_y.append(0.5)
-    # Expense nodes: evenly spaced
-    expense_y_spacing = 1 / (num_expense + 1)
-    for i in range(num_expense):
-        node_y.append((i + 1) * expense_y_spacing)
+    # Income nodes at x=0, Budget node at x=0.5, Expense nodes at x=1
+    node_x = [0.0] * num_income + [0.5] + [1.0] * num_expense
+    # Income and expense nodes evenly spaced, Budget node centered
+    node_y = _evenly_spaced(num_income) + [0.5] + _evenly_spaced(num_expense)
+
+    # Merge title and custom layout into the defaults, so the figure is created with its final layout
+    layout = {
+        **_DEFAULT_LAYOUT,
+        "title_text": title,
+        "title_font": {**_DEFAULT_LAYOUT["title_font"], "color": title_color},
+        **(layout or {})
+    }
 
     # Create the Sankey diagram
     fig = go.Figure(data=[go.Sankey(
@@ -130,25 +127,101 @@ def create_budget_sankey(
             color=colors,
             hovertemplate='%{source.label} → %{target.label}: $%{value}<extra></extra>'
         )
-    )])
+    )], layout=layout)
 
-    # Prepare layout update dictionary
-    layout_update = {
-        "title_text": title,
-        "title_font": {"size": 24, "color": title_color},
-        "font_size": 12,
-        "height": 700,
-        "width": 1000
-    }
+    return fig
 
-    # If a custom layout is provided, merge it into the layout update
-    if layout:
-        layout_update.update(layout)
+def _report_totals(total_income, total_expenses):
+    """Shows the total income and expenses, warning when expenses exceed income.
 
-    # Update layout
-    fig.update_layout(layout_update)
+    Parameters:
+    - total_income (float): Sum of all income sources.
+    - total_expenses (float): Sum of all expense categories.
+    """
+    if total_income < total_expenses:
+        discrepancy = total_expenses - total_income
+        st.warning(f"Total expenses (${total_expenses:,.2f}) exceed total income (${total_income:,.2f}).")
+        st.warning(f"Discrepancy: ${discrepancy:,.2f}")
+    else:
+        st.success(f"Total Income: ${total_income:,.2f}")
+        st.success(f"Total Expenses: ${total_expenses:,.2f}")
 
-    return fig
+def create_budget_sankey(
+    income_sources,
+    expenses,
+    title="Budget Sankey Diagram",
+    title_color="black",
+    layout=None
+):
+    """Creates a dynamic Sankey diagram to visualize a budget with three verticals:
+    Income -> Budget -> Expenses. Each node displays its amount next to its label.
+
+    Parameters:
+    - income_sources (dict): Dictionary of income sources and their amounts.
+    - expenses (dict): Dictionary of expense categories and their amounts.
+    - title (str): Title of the Sankey diagram.
+    - title_color (str): Color of the title text.
+    - layout (dict): Layout configuration for the Plotly figure.
+
+    Returns:
+    - fig (go.Figure): Plotly Figure object representing the Sankey diagram,
+      or an empty figure if there are no income sources or no expenses.
+    """
+    
+    # Skip all work on degenerate input, e.g. while the user is still filling in the sidebar
+    if not income_sources or not expenses:
+        return go.Figure()
+
+    # Calculate total income and expenses
+    total_income = fsum(income_sources.values())
+    total_expenses = fsum(expenses.values())
+
+    # Validate total income vs expenses
+    _report_totals(total_income, total_expenses)
+
+    return _build_sankey(income_sources, expenses, total_income, title, title_color, layout)
+
+@st.fragment
+def sankey_section(income_sources, expenses, title, title_color, custom_layout):
+    """Renders the generate button and the Sankey diagram as a Streamlit fragment, so that
+    pressing the button reruns only this section instead of the whole script.
+
+    Parameters:
+    - income_sources (dict): Dictionary of income sources and their amounts.
+    - expenses (dict): Dictionary of expense categories and their amounts.
+    - title (str): Title of the Sankey diagram.
+    - title_color (str): Color of the title text.
+    - custom_layout (dict): Layout configuration for the Plotly figure.
+    """
+    if st.button("Generate Sankey Diagram"):
+        if not income_sources:
+            st.error("Please enter at least one income source.")
+        elif not expenses:
+            st.error("Please enter at least one expense category.")
+        else:
+            # Calculate and report the totals once; every branch below reuses them
+            total_income = fsum(income_sources.values())
+            _report_totals(total_income, fsum(expenses.values()))
+
+            layout_items = tuple(sorted(custom_layout.items()))
+            # Node positions, colors, links and layout only depend on the node counts, title and layout,
+            # so when those are unchanged the figure kept in session state only needs new labels and values;
+            # identical inputs reuse it as is
+            template_key = (len(income_sources), len(expenses), title, title_color, layout_items)
+            input_key = (tuple(income_sources.items()), tuple(expenses.items()), title, title_color, layout_items)
+
+            fig = st.session_state.get("sankey_fig")
+            if fig is None or st.session_state.get("sankey_template_key") != template_key:
+                fig = _build_sankey(income_sources, expenses, total_income, title, title_color, custom_layout)
+                st.session_state["sankey_fig"] = fig
+                st.session_state["sankey_template_key"] = template_key
+            elif st.session_state.get("sankey_input_key") != input_key:
+                fig.data[0].node.update(label=_node_labels(income_sources, expenses, total_income))
+                fig.data[0].link.update(value=list(income_sources.values()) + list(expenses.values()))
+            st.session_state["sankey_input_key"] = input_key
+
+            # A stable key lets the frontend update the existing chart instead of mounting a new one
+            st.plotly_chart(fig, use_container_width=True, key="budget_sankey")
 
 def main():
     st.set_page_config(page_title="Budget Sankey Diagram", layout="wide")
@@ -158,7 +231,7 @@ def main():
 
     # === 1. Input Income Sources ===
     st.sidebar.subheader("Income Sources")
-    income_sources = {}
+    income_rows = {}
     num_incomes = st.sidebar.number_input("Number of Income Sources", min_value=1, max_value=20, value=2, step=1)
     for i in range(int(num_incomes)):
         col1, col2 = st.sidebar.columns(2)
@@ -167,13 +240,18 @@ def main():
         with col2:
             income_amount = st.number_input(f"Amount for {income_name}", min_value=0.0, value=1000.0, step=100.0, key=f"income_amount_{i}")
         if income_name:
-            income_sources[income_name] = income_amount
+            income_rows.setdefault(income_name, []).append(income_amount)
+    # Merge rows sharing a name into a single flow; fsum keeps the total independent of row order
+    income_sources = {name: fsum(amounts) for name, amounts in income_rows.items()}
+    duplicate_incomes = [name for name, amounts in income_rows.items() if len(amounts) > 1]
+    if duplicate_incomes:
+        st.sidebar.warning(f"Combined duplicate income sources: {', '.join(duplicate_incomes)}")
 
     st.sidebar.markdown("---")
 
     # === 2. Input Expense Categories ===
     st.sidebar.subheader("Expense Categories")
-    expenses = {}
+    expense_rows = {}
     num_expenses = st.sidebar.number_input("Number of Expense Categories", min_value=1, max_value=20, value=3, step=1)
     for i in range(int(num_expenses)):
         col1, col2 = st.sidebar.columns(2)
@@ -182,7 +260,12 @@ def main():
         with col2:
             expense_amount = st.number_input(f"Amount for {expense_name}", min_value=0.0, value=500.0, step=50.0, key=f"expense_amount_{i}")
         if expense_name:
-            expenses[expense_name] = expense_amount
+            expense_rows.setdefault(expense_name, []).append(expense_amount)
+    # Merge rows sharing a name into a single flow; fsum keeps the total independent of row order
+    expenses = {name: fsum(amounts) for name, amounts in expense_rows.items()}
+    duplicate_expenses = [name for name, amounts in expense_rows.items() if len(amounts) > 1]
+    if duplicate_expenses:
+        st.sidebar.warning(f"Combined duplicate expense categories: {', '.join(duplicate_expenses)}")
 
     st.sidebar.markdown("---")
 
@@ -201,20 +284,7 @@ def main():
     }
 
     # === 5. Create and Display the Sankey Diagram ===
-    if st.sidebar.button("Generate Sankey Diagram"):
-        if not income_sources:
-            st.error("Please enter at least one income source.")
-        elif not expenses:
-            st.error("Please enter at least one expense category.")
-        else:
-            fig = create_budget_sankey(
-                income_sources=income_sources,
-                expenses=expenses,
-                title=title,
-                title_color=title_color,
-                layout=custom_layout
-            )
-            st.plotly_chart(fig, use_container_width=True)
+    sankey_section(income_sources, expenses, title, title_color, custom_layout)
 
 if __name__ == "__main__":
     main()